@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""
+hotpaths.py
+
+Benchmark the hot paths of the LMG95 driver and the powerlog95 logger.
+
+All stages run offline. LMG95 rows with the 16 values of powerlog95.VAL are
+built from the recorded example/lmg95.log, and LMG670 rows (78 columns) from
+example/lmg670.log. Stages that read from the device use an lmg95 object
+connected to one end of a socketpair, with a thread playing the device on
+the other end. The sink stages drive the real powerlog95 sinks, with null
+InfluxDB and MQTT clients.
+
+Each stage is run once to warm up and then several times; µs/row is the
+median over the runs, with the interquartile range (IQR) as a measure of
+noise. alloc/row is the peak of memory allocated while processing one row
+(bytes, measured with tracemalloc in a separate pass), as CPython does not
+count allocations.
+
+Usage:
+    python3 bench/hotpaths.py [-o results.json] [--compare baseline.json]
+
+With --compare, a stage is reported as a regression if its median µs/row
+grew by more than --threshold percent and by more than --noise times the
+larger IQR of both measurements, or if its alloc/row grew by more than
+--threshold percent. The script then exits with status 1.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import warnings
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+with warnings.catch_warnings():
+    # telnetlib is deprecated, but it is what the driver uses.
+    warnings.simplefilter("ignore", DeprecationWarning)
+    import lmg95
+import powerlog95
+import powerlogfile
+
+LMG670_CHANNELS = 6
+
+
+class NullOutput(io.TextIOBase):
+    """Text stream that discards everything written to it."""
+
+    def write(self, s):
+        return len(s)
+
+
+NULL_OUT = NullOutput()
+
+
+def load_lmg95_rows() -> list[list[float]]:
+    """Return rows in powerlog95.VAL order, based on example/lmg95.log.
+
+    The recording predates the reactive and apparent power columns; these
+    are derived from the recorded values.
+    """
+    rows = []
+    with open(os.path.join(REPO, "example", "lmg95.log"),
+              encoding="utf-8") as f:
+        names = f.readline().split()[1:]
+        for line in f:
+            values = dict(zip(names, (float(x) for x in line.split())))
+            values["s"] = values["utrms"] * values["itrms"]
+            values["q"] = math.sqrt(max(values["s"] ** 2 - values["p"] ** 2,
+                                        0.0))
+            rows.append([values[k] for k in powerlog95.VAL])
+    return rows
+
+
+def powerlog670_values() -> list[str]:
+    """Column names of the LMG670 logger (powerlog670.py is Python 2)."""
+    names = "tsnorm durnorm utrms itrms udc idc ucf icf uff iff p pf fcyc"
+    return [v + str(c) for c in range(1, LMG670_CHANNELS + 1)
+            for v in names.split()]
+
+
+def load_lmg670_rows() -> list[list[float]]:
+    """Return 78-column LMG670 rows as floats, based on example/lmg670.log.
+
+    The tsnorm columns are timestamps in the device's string format; they
+    are replaced by the row time in seconds to get all-float rows.
+    """
+    per_channel = len(powerlog670_values()) // LMG670_CHANNELS
+    rows = []
+    with open(os.path.join(REPO, "example", "lmg670.log"),
+              encoding="utf-8") as f:
+        for n, line in enumerate(f):
+            if line.startswith("#"):
+                continue
+            values = line.split()
+            row = []
+            for i, value in enumerate(values):
+                if i % per_channel == 0:
+                    row.append(1421860855.0 + 0.5 * n)
+                else:
+                    row.append(float(value))
+            rows.append(row)
+    return rows
+
+
+def cycle(rows: list, n: int) -> list:
+    """Return `n` rows, repeating `rows` as needed."""
+    return [rows[i % len(rows)] for i in range(n)]
+
+
+class NullInfluxDB:
+    """Stand-in for InfluxDBClient that discards all points."""
+
+    def write_points(self, points, time_precision=None):
+        pass
+
+
+class NullMQTT:
+    """Stand-in for a paho-mqtt client that discards all messages."""
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        pass
+
+
+class FakeDevice(threading.Thread):
+    """Play an LMG95 in continuous mode on one end of a socketpair."""
+
+    def __init__(self, sock: socket.socket, rows: list[list[float]]):
+        super().__init__(name="fake-lmg95", daemon=True)
+        self._sock = sock
+        lines = [";".join(repr(x) for x in row) + lmg95.EOS for row in rows]
+        self._data = "".join(lines).encode("ascii")
+
+    def run(self) -> None:
+        try:
+            self._sock.sendall(self._data)
+        except OSError:
+            pass  # reader closed the connection early
+
+
+def connect_fake_device(rows: list[list[float]]):
+    """Return an lmg95 object reading `rows` from a fake device."""
+    dev_sock, lmg_sock = socket.socketpair()
+    lmg = lmg95.lmg95()
+    lmg._t.sock = lmg_sock
+    device = FakeDevice(dev_sock, rows)
+    device.start()
+
+    def teardown():
+        lmg_sock.close()
+        device.join()
+        dev_sock.close()
+
+    return lmg, teardown
+
+
+# Each stage is a setup function taking the number of rows to process and
+# returning (step, teardown); step(i) processes row i.
+
+def stage_recv_str(n, data):
+    lmg, teardown = connect_fake_device(cycle(data["lmg95"], n))
+    return (lambda i: lmg.recv_str()), teardown
+
+
+def stage_read_values(n, data):
+    lmg, teardown = connect_fake_device(cycle(data["lmg95"], n))
+    return (lambda i: lmg.read_values()), teardown
+
+
+def sink_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parse powerlog95 sink options, e.g. ["-L", "file"]."""
+    parser = argparse.ArgumentParser()
+    for sink_cls in powerlog95.BUILTIN_SINKS.values():
+        sink_cls.add_arguments(parser)
+    return parser.parse_args(argv or [])
+
+
+def run_sinks(sinks: list, rows: list[list[float]]):
+    """Return (step, teardown) writing one row at a time to `sinks`."""
+
+    def step(i):
+        powerlog95.write_rows(sinks, [rows[i]])
+
+    def teardown():
+        for sink in reversed(sinks):
+            sink.close()
+
+    return step, teardown
+
+
+def with_tmpdir(setup):
+    """Run a stage setup with a temporary directory as first argument."""
+
+    def wrapper(n, data):
+        tmpdir = tempfile.TemporaryDirectory()
+        step, teardown = setup(tmpdir.name, n, data)
+
+        def cleanup():
+            teardown()
+            tmpdir.cleanup()
+
+        return step, cleanup
+
+    return wrapper
+
+
+def stage_nan_filter(n, data):
+    rows = cycle(data["lmg95"], n)
+    nan_filter = powerlog95.nan_filter
+    return (lambda i: [nan_filter(v) for v in rows[i]]), None
+
+
+def stage_nan_filter_lmg670(n, data):
+    rows = cycle(data["lmg670"], n)
+    nan_filter = powerlog95.nan_filter
+    return (lambda i: [nan_filter(v) for v in rows[i]]), None
+
+
+def stage_influxdb_sink(n, data):
+    sink = powerlog95.InfluxDBSink(sink_args(), powerlog95.VAL,
+                                   influx=NullInfluxDB())
+    return run_sinks([sink], cycle(data["timed"], n))
+
+
+def stage_mqtt_sink(n, data):
+    sink = powerlog95.MQTTSink(sink_args(), powerlog95.VAL,
+                               mqtt_client=NullMQTT())
+    return run_sinks([sink], cycle(data["timed"], n))
+
+
+def stage_stdout_sink(n, data):
+    sink = powerlog95.StdoutSink(sink_args(["-v"]), powerlog95.VAL)
+    step, teardown = run_sinks([sink], cycle(data["timed"], n))
+
+    def redirected(i):
+        stdout, sys.stdout = sys.stdout, NULL_OUT
+        try:
+            step(i)
+        finally:
+            sys.stdout = stdout
+
+    return redirected, teardown
+
+
+@with_tmpdir
+def stage_file_sink(tmpdir, n, data):
+    args = sink_args(["-L", os.path.join(tmpdir, "powerlog.log")])
+    sink = powerlog95.FileSink(args, powerlog95.VAL)
+    return run_sinks([sink], cycle(data["timed"], n))
+
+
+@with_tmpdir
+def stage_file_sink_lmg670(tmpdir, n, data):
+    args = sink_args(["-L", os.path.join(tmpdir, "powerlog.log")])
+    sink = powerlog95.FileSink(args, powerlog670_values())
+    return run_sinks([sink], cycle(data["lmg670"], n))
+
+
+@with_tmpdir
+def stage_file_write(tmpdir, n, data):
+    rows = cycle(data["timed"], n)
+    log = powerlogfile.RotatingLog(os.path.join(tmpdir, "powerlog.log"))
+    lines = [" ".join([str(x) for x in row]) for row in rows]
+    return (lambda i: log.write(lines[i])), log.close
+
+
+@with_tmpdir
+def stage_file_write_rotating(tmpdir, n, data):
+    """File writes while rotated segments are compressed in the background.
+
+    Compare with file_write: compression must not slow down the writer.
+    """
+    rows = cycle(data["timed"], n)
+    log = powerlogfile.RotatingLog(os.path.join(tmpdir, "powerlog.log"),
+                                   max_bytes=256 << 10, compress="xz")
+    lines = [" ".join([str(x) for x in row]) for row in rows]
+    return (lambda i: log.write(lines[i])), log.close
+
+
+@with_tmpdir
+def stage_end_to_end(tmpdir, n, data):
+    """The powerlog95 acquisition loop with all built-in sinks but stdout."""
+    lmg, device_teardown = connect_fake_device(cycle(data["lmg95"], n))
+    args = sink_args(["-L", os.path.join(tmpdir, "powerlog.log"),
+                      "--event", "threshold:p:above=1e6,hyst=100",
+                      "--event", "cusum:p:h=1e9"])
+    file_sink = powerlog95.FileSink(args, powerlog95.VAL)
+    mqtt_sink = powerlog95.MQTTSink(args, powerlog95.VAL,
+                                    mqtt_client=NullMQTT())
+    event_sink = powerlog95.EventSink(args, powerlog95.VAL,
+                                      log=file_sink.log,
+                                      mqtt_client=mqtt_sink.client)
+    influx_sink = powerlog95.InfluxDBSink(args, powerlog95.VAL,
+                                          influx=NullInfluxDB())
+    sinks = [event_sink, file_sink, influx_sink, mqtt_sink]
+    _, sinks_teardown = run_sinks(sinks, [])
+
+    def step(i):
+        powerlog95.write_rows(sinks, [powerlog95.read_row(lmg)])
+
+    def teardown():
+        device_teardown()
+        sinks_teardown()
+
+    return step, teardown
+
+
+STAGES = {
+    "lmg95.recv_str": stage_recv_str,
+    "lmg95.read_values": stage_read_values,
+    "nan_filter": stage_nan_filter,
+    "nan_filter.lmg670": stage_nan_filter_lmg670,
+    "InfluxDBSink.write": stage_influxdb_sink,
+    "MQTTSink.write": stage_mqtt_sink,
+    "StdoutSink.write": stage_stdout_sink,
+    "FileSink.write": stage_file_sink,
+    "FileSink.write.lmg670": stage_file_sink_lmg670,
+    "file_write": stage_file_write,
+    "file_write.rotating": stage_file_write_rotating,
+    "end_to_end": stage_end_to_end,
+}
+
+
+def time_stage(setup, n: int, repeat: int, data: dict) -> list[float]:
+    """Return the time per row in seconds for each of `repeat` runs.
+
+    An additional first run warms up caches and is not counted.
+    """
+    times = []
+    for _ in range(repeat + 1):
+        with contextlib.redirect_stdout(NULL_OUT):
+            step, teardown = setup(n, data)
+        t0 = time.perf_counter()
+        for i in range(n):
+            step(i)
+        elapsed = time.perf_counter() - t0
+        if teardown:
+            with contextlib.redirect_stdout(NULL_OUT):
+                teardown()
+        times.append(elapsed / n)
+    return times[1:]
+
+
+def alloc_stage(setup, n: int, data: dict) -> float:
+    """Return the mean peak allocation per row in bytes."""
+    with contextlib.redirect_stdout(NULL_OUT):
+        step, teardown = setup(n, data)
+    total = 0
+    tracemalloc.start()
+    try:
+        for i in range(n):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            step(i)
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+        if teardown:
+            with contextlib.redirect_stdout(NULL_OUT):
+                teardown()
+    return total / n
+
+
+def run(stages: list[str], n: int, repeat: int, alloc_rows: int) -> dict:
+    """Run the given stages and return the results document."""
+    rows = load_lmg95_rows()
+    data = {
+        "lmg95": rows,
+        "timed": [[1343641646.41 + 0.5 * i] + row
+                  for i, row in enumerate(rows)],
+        "lmg670": load_lmg670_rows(),
+    }
+    results = {}
+    for name in stages:
+        times = [t * 1e6 for t in time_stage(STAGES[name], n, repeat, data)]
+        q1, median, q3 = statistics.quantiles(times, n=4, method="inclusive")
+        alloc = alloc_stage(STAGES[name], alloc_rows, data)
+        results[name] = {
+            "rows_per_s": 1e6 / median,
+            "us_per_row": median,
+            "us_per_row_iqr": q3 - q1,
+            "alloc_bytes_per_row": alloc,
+        }
+        print(f"{name:22s} {1e6 / median:10.0f} rows/s "
+              f"{median:9.2f} ± {q3 - q1:5.2f} µs/row {alloc:8.0f} B/row")
+    return {
+        "meta": {
+            "time": time.time(),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "rows": n,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float,
+            noise: float) -> list[str]:
+    """Return a description of each regression.
+
+    Timing changes only count if they exceed both `threshold` percent and
+    `noise` times the larger IQR of the two measurements.
+    """
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        for key in ("us_per_row", "alloc_bytes_per_row"):
+            if base[key] <= 0:
+                continue
+            limit = base[key] * threshold / 100.0
+            if key == "us_per_row":
+                spread = max(base.get("us_per_row_iqr", 0.0),
+                             result["us_per_row_iqr"])
+                limit = max(limit, noise * spread)
+            change = result[key] - base[key]
+            if change > limit:
+                regressions.append(
+                    f"{name}: {key} {base[key]:.2f} -> {result[key]:.2f} "
+                    f"(+{change / base[key] * 100.0:.1f}%, "
+                    f"limit +{limit:.2f})")
+    return regressions
+
+
+def main():
+    """Application entry point"""
+    parser = argparse.ArgumentParser(
+        description="Benchmark driver and logger hot paths")
+    parser.add_argument("stages", nargs="*", default=list(STAGES),
+                        help="Stages to run (default: all)")
+    parser.add_argument("-n", "--rows", type=int, default=20000,
+                        help="Rows per run (default: 20000)")
+    parser.add_argument("-r", "--repeat", type=int, default=7,
+                        help="Runs per stage, the median is reported "
+                             "(default: 7)")
+    parser.add_argument("--alloc-rows", type=int, default=1000,
+                        help="Rows for the allocation pass (default: 1000)")
+    parser.add_argument("-o", "--output", help="Store results as JSON")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="Compare against results stored with -o")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="Regression threshold in percent (default: 10)")
+    parser.add_argument("--noise", type=float, default=3.0,
+                        help="Minimum timing regression in multiples of the "
+                             "IQR (default: 3)")
+    args = parser.parse_args()
+
+    if args.repeat < 2:
+        parser.error("--repeat must be at least 2")
+    unknown = [s for s in args.stages if s not in STAGES]
+    if unknown:
+        parser.error("unknown stage: " + ", ".join(unknown)
+                     + " (available: " + ", ".join(STAGES) + ")")
+
+    current = run(args.stages, args.rows, args.repeat, args.alloc_rows)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold,
+                              args.noise)
+        if regressions:
+            print("regressions:")
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print("no regressions")
+
+
+if __name__ == "__main__":
+    main()
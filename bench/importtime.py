@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+importtime.py
+
+Measure the import time of the powerlog modules with `python -X importtime`.
+
+Each module is imported in a fresh interpreter several times; the best
+cumulative time is reported, together with the slowest modules it pulls in.
+The sink client libraries (influxdb, paho-mqtt) are measured separately, if
+installed, to show what importing them eagerly would add to every start.
+
+Usage:
+    python3 bench/importtime.py [-n REPEAT] [MODULE ...]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = ["powerlog95", "powerlogfile", "lmg95"]
+SINK_LIBRARIES = ["influxdb", "paho.mqtt.client"]
+
+
+def import_times(module: str) -> dict[str, int] | None:
+    """Import `module` in a fresh interpreter and return cumulative µs.
+
+    The result maps `module` and each module it imports directly to its
+    cumulative import time. Returns None if the import fails.
+    """
+    env = dict(os.environ, PYTHONPATH=REPO)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env, cwd=REPO, capture_output=True, text=True, check=False)
+    if result.returncode != 0:
+        return None
+    # A module is reported after everything it imports, one indentation
+    # level deeper; the requested module is the last top-level entry.
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((depth, name.strip(), int(cumulative)))
+    times = {}
+    for depth, name, cumulative in reversed(entries):
+        if depth == 0:
+            if times:
+                break
+            times[name] = cumulative
+        elif depth == 1:
+            times[name] = cumulative
+    return times
+
+
+def best_of(module: str, repeat: int) -> dict[str, int] | None:
+    """Return the run of `repeat` with the lowest total for `module`."""
+    best = None
+    for _ in range(repeat):
+        times = import_times(module)
+        if times is None:
+            return None
+        if best is None or times[module] < best[module]:
+            best = times
+    return best
+
+
+def main():
+    """Application entry point"""
+    parser = argparse.ArgumentParser(
+        description="Measure import time of the powerlog modules")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES,
+                        help="Modules to import (default: %(default)s)")
+    parser.add_argument("-n", "--repeat", type=int, default=5,
+                        help="Number of runs per module, best is reported")
+    parser.add_argument("-t", "--top", type=int, default=5,
+                        help="Number of slowest dependencies to list")
+    args = parser.parse_args()
+
+    for module in args.modules + SINK_LIBRARIES:
+        times = best_of(module, args.repeat)
+        if times is None:
+            print(f"{module:20s} not installed")
+            continue
+        print(f"{module:20s} {times[module] / 1000:8.1f} ms")
+        deps = sorted(((t, n) for n, t in times.items() if n != module),
+                      reverse=True)
+        for t, n in deps[:args.top]:
+            print(f"    {n:24s} {t / 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
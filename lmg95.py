@@ -13,6 +13,12 @@ import time
 EOS = "\r\n"
 TIMEOUT = 5
 
+# Values reported for invalid (NaN) and overrange (+/-Inf) results
+SENTINELS = (9.91e37, 9.9e37, -9.9e37)
+
+def is_sentinel(value: float) -> bool:
+    return value in SENTINELS
+
 class scpi_socket:
     def __init__(self, host = "", port = 0):
         self._s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -14,24 +14,12 @@ Author:
 
 import argparse
 import json
+from abc import ABC, abstractmethod
 import signal
 import sys
 import time
 import lmg95
-
-HAS_INFLUXDB = False
-try:
-    import influxdb
-    HAS_INFLUXDB = True
-except ImportError:
-    pass
-
-HAS_MQTT = False
-try:
-    import paho.mqtt.client as mqtt
-    HAS_MQTT = True
-except ImportError:
-    pass
+import powerlogfile
 
 VAL = [
     "count", # Measurement cycle count. Wraps back to 0 after 65535.
@@ -90,21 +78,26 @@ def _raise_keyboard_interrupt(signum, frame):
 
 def nan_filter(value: float):
     """Return None for LMG95 sentinel NaN/Inf values."""
-    if value in (9.91e37, 9.9e37, -9.9e37):
+    if lmg95.is_sentinel(value):
         return None
     return value
 
 
-def send_to_influxdb(influx, data: list[float]) -> None:
-    """Send a measurement row to InfluxDB."""
+def influxdb_point(data: list[float]) -> dict:
+    """Build the InfluxDB point for a measurement row."""
     fields = {k: nan_filter(v) for k, v in zip(VAL, data[1:])}
-    item = {
+    return {
         "measurement": "powerlog",
         "tags": {},
         "time": int(data[0] * 1000),
         "fields": fields,
     }
-    influx.write_points([item], time_precision="ms")
+
+
+def send_to_influxdb(influx, rows: list[list[float]]) -> None:
+    """Send a batch of measurement rows to InfluxDB."""
+    influx.write_points([influxdb_point(data) for data in rows],
+                        time_precision="ms")
 
 
 def on_mqtt_connect(client, userdata, flags, reason_code, *args) -> None:
@@ -120,6 +113,25 @@ def on_mqtt_connect(client, userdata, flags, reason_code, *args) -> None:
         print("MQTT connected")
 
 
+def connect_mqtt(args: argparse.Namespace):
+    """Connect to the MQTT broker given in `args` and start the network loop."""
+    try:
+        import paho.mqtt.client as mqtt
+    except ImportError as e:
+        raise ImportError("paho-mqtt package not installed") from e
+
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    else:
+        client = mqtt.Client()
+    client.on_connect = on_mqtt_connect
+    if args.mqtt_username:
+        client.username_pw_set(args.mqtt_username, args.mqtt_password)
+    client.connect(args.mqtt_host, args.mqtt_port)
+    client.loop_start()
+    return client
+
+
 def publish_mqtt_discovery(client, topic: str) -> None:
     """Publish Home Assistant MQTT Discovery messages for all sensors."""
     device = {
@@ -151,66 +163,132 @@ def publish_mqtt_state(client, topic: str, data: list[float]) -> None:
     client.publish(f"{topic}/state", json.dumps(state))
 
 
-def main():
-    """Application entry point"""
-    parser = argparse.ArgumentParser(
-        description="Log measured values from ZES Zimmer LMG95 Power Meter")
-    parser.add_argument("host", help="Hostname of RS232-Ethernet converter")
-    parser.add_argument("-L", "--logfile", help="Log values to file")
-    parser.add_argument("-p", "--port", type=int, default=2101,
-                        help="TCP port of RS232-Ethernet converter")
-    parser.add_argument("-v", "--verbose", action="store_true", default=False,
-                        help="Dump measurements to stdout")
-    parser.add_argument("-l", "--lowpass", action="store_true", default=False,
-                        help="Enable 60 Hz low pass filter")
-    parser.add_argument("-i", "--interval", type=float, default=0.5,
-                        help="Measurement interval in seconds")
-    parser.add_argument("--current-range", type=float, default=None,
-                        help="Fixed current range in A "
-                             "(default: automatic ranging)")
-    parser.add_argument("--voltage-range", type=float, default=None,
-                        help="Fixed voltage range in V "
-                             "(default: automatic ranging)")
+class Sink(ABC):
+    """Destination for measurement rows.
 
-    influx_group = parser.add_argument_group("InfluxDB")
-    influx_group.add_argument("--influxdb", action="store_true", default=False,
-                              help="Write data to InfluxDB")
-    influx_group.add_argument("--influxdb-host", default="localhost",
-                              help="InfluxDB hostname (default: localhost)")
-    influx_group.add_argument("--influxdb-port", type=int, default=8086,
-                              help="InfluxDB port (default: 8086)")
-    influx_group.add_argument("--influxdb-database", default="powerlog",
-                              help="InfluxDB database name (default: powerlog)")
-    influx_group.add_argument("--influxdb-username", default=None,
-                              help="InfluxDB username (omit for no authentication)")
-    influx_group.add_argument("--influxdb-password", default=None,
-                              help="InfluxDB password")
-
-    mqtt_group = parser.add_argument_group("MQTT")
-    mqtt_group.add_argument("--mqtt", action="store_true", default=False,
-                            help="Publish data via MQTT")
-    mqtt_group.add_argument("--mqtt-host", default="localhost",
-                            help="MQTT broker hostname (default: localhost)")
-    mqtt_group.add_argument("--mqtt-port", type=int, default=1883,
-                            help="MQTT broker port (default: 1883)")
-    mqtt_group.add_argument("--mqtt-topic", default="lmgtools",
-                            help="MQTT base topic (default: lmgtools)")
-    mqtt_group.add_argument("--mqtt-username", default=None,
-                            help="MQTT username (omit for no authentication)")
-    mqtt_group.add_argument("--mqtt-password", default=None,
-                            help="MQTT password")
+    A row is a list of floats: the host timestamp followed by the values
+    named in `fields`. Sinks are selected by their own command line options
+    (see `enabled()`) or, for plugins, by `--sink NAME`.
 
-    args = parser.parse_args()
+    Third-party sinks are registered in the entry point group
+    `lmgtools.sinks` and only loaded when requested. Any client library a
+    sink needs must be imported in `__init__`, not at module level, so that
+    disabled sinks add nothing to the startup time.
+    """
 
-    if args.influxdb and not HAS_INFLUXDB:
-        print("error: influxdb package not installed", file=sys.stderr)
-        sys.exit(1)
-    if args.mqtt and not HAS_MQTT:
-        print("error: paho-mqtt package not installed", file=sys.stderr)
-        sys.exit(1)
+    @staticmethod
+    def add_arguments(parser: argparse.ArgumentParser) -> None:
+        """Register the sink's command line options."""
+
+    @staticmethod
+    def enabled(args: argparse.Namespace) -> bool:
+        """Return True if the options in `args` ask for this sink."""
+        return False
+
+    def __init__(self, args: argparse.Namespace, fields: list[str]):
+        self.fields = fields
+
+    @abstractmethod
+    def write(self, rows: list[list[float]]) -> None:
+        """Write a batch of measurement rows."""
+
+    def close(self) -> None:
+        """Flush pending data and release resources."""
+
+
+class StdoutSink(Sink):
+    """Dump measurements to stdout."""
+
+    @staticmethod
+    def add_arguments(parser):
+        parser.add_argument("-v", "--verbose", action="store_true",
+                            default=False,
+                            help="Dump measurements to stdout")
+
+    @staticmethod
+    def enabled(args):
+        return args.verbose
+
+    def write(self, rows):
+        sys.stdout.write("".join(" ".join([str(x) for x in data]) + "\n"
+                                 for data in rows))
+        sys.stdout.flush()
+
+
+class FileSink(Sink):
+    """Log measurements to a (rotating) text file."""
+
+    @staticmethod
+    def add_arguments(parser):
+        parser.add_argument("-L", "--logfile", help="Log values to file")
+        parser.add_argument("--rotate-size", type=powerlogfile.parse_size,
+                            default=None,
+                            help="Rotate the log file when it exceeds this "
+                                 "size (e.g. 100M)")
+        parser.add_argument("--rotate-interval", type=float, default=None,
+                            help="Rotate the log file after this many seconds")
+        parser.add_argument("--compress", default="gzip",
+                            choices=list(powerlogfile.SUFFIX),
+                            help="Compression of rotated log segments "
+                                 "(default: gzip)")
+
+    @staticmethod
+    def enabled(args):
+        return bool(args.logfile)
+
+    def __init__(self, args, fields):
+        super().__init__(args, fields)
+        self.log = powerlogfile.RotatingLog(
+            args.logfile, header="# time " + " ".join(fields),
+            max_bytes=args.rotate_size, max_age=args.rotate_interval,
+            compress=args.compress)
+        print("writing values to", args.logfile)
+
+    def write(self, rows):
+        for data in rows:
+            self.log.write(" ".join([str(x) for x in data]))
+
+    def close(self):
+        self.log.close()
+
+
+class InfluxDBSink(Sink):
+    """Write measurements to an InfluxDB (1.x) database."""
+
+    @staticmethod
+    def add_arguments(parser):
+        group = parser.add_argument_group("InfluxDB")
+        group.add_argument("--influxdb", action="store_true", default=False,
+                           help="Write data to InfluxDB")
+        group.add_argument("--influxdb-host", default="localhost",
+                           help="InfluxDB hostname (default: localhost)")
+        group.add_argument("--influxdb-port", type=int, default=8086,
+                           help="InfluxDB port (default: 8086)")
+        group.add_argument("--influxdb-database", default="powerlog",
+                           help="InfluxDB database name (default: powerlog)")
+        group.add_argument("--influxdb-username", default=None,
+                           help="InfluxDB username "
+                                "(omit for no authentication)")
+        group.add_argument("--influxdb-password", default=None,
+                           help="InfluxDB password")
+
+    @staticmethod
+    def enabled(args):
+        return args.influxdb
+
+    def __init__(self, args, fields, influx=None):
+        """Connect to the server, unless an `influx` client is given."""
+        super().__init__(args, fields)
+        self._owns_client = influx is None
+        self._influx = influx if influx is not None else self._connect(args)
+
+    @staticmethod
+    def _connect(args):
+        try:
+            import influxdb
+        except ImportError as e:
+            raise ImportError("influxdb package not installed") from e
 
-    influx = None
-    if args.influxdb:
         influx_kwargs = {
             "host": args.influxdb_host,
             "port": args.influxdb_port,
@@ -225,19 +303,267 @@ def main():
         except influxdb.exceptions.InfluxDBClientError as e:
             # A write-only user cannot create databases; assume it exists.
             print("warning: could not create database:", e, file=sys.stderr)
+        return influx
+
+    def write(self, rows):
+        send_to_influxdb(self._influx, rows)
+
+    def close(self):
+        if self._owns_client:
+            self._influx.close()
+
+
+class MQTTSink(Sink):
+    """Publish measurements via MQTT, with Home Assistant discovery."""
+
+    @staticmethod
+    def add_arguments(parser):
+        group = parser.add_argument_group("MQTT")
+        group.add_argument("--mqtt", action="store_true", default=False,
+                           help="Publish data via MQTT")
+        group.add_argument("--mqtt-host", default="localhost",
+                           help="MQTT broker hostname (default: localhost)")
+        group.add_argument("--mqtt-port", type=int, default=1883,
+                           help="MQTT broker port (default: 1883)")
+        group.add_argument("--mqtt-topic", default="lmgtools",
+                           help="MQTT base topic (default: lmgtools)")
+        group.add_argument("--mqtt-username", default=None,
+                           help="MQTT username (omit for no authentication)")
+        group.add_argument("--mqtt-password", default=None,
+                           help="MQTT password")
+
+    @staticmethod
+    def enabled(args):
+        return args.mqtt
+
+    def __init__(self, args, fields, mqtt_client=None):
+        """Connect to the broker, unless an `mqtt_client` is given."""
+        super().__init__(args, fields)
+        self._owns_client = mqtt_client is None
+        self.client = (mqtt_client if mqtt_client is not None
+                       else connect_mqtt(args))
+        self._topic = args.mqtt_topic
+        publish_mqtt_discovery(self.client, self._topic)
+
+    def write(self, rows):
+        for data in rows:
+            publish_mqtt_state(self.client, self._topic, data)
+
+    def close(self):
+        if self._owns_client:
+            self.client.loop_stop()
+            self.client.disconnect()
+
+
+class EventSink(Sink):
+    """Detect events in the live data and notify a socket, MQTT and the log.
+
+    Runs first in the sink chain so that events are reported within the
+    measurement cycle in which they occur.
+    """
 
-    mqtt_client = None
-    if args.mqtt:
-        if hasattr(mqtt, "CallbackAPIVersion"):
-            mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    @staticmethod
+    def add_arguments(parser):
+        group = parser.add_argument_group(
+            "Events", "Rules are KIND:FIELD[:KEY=VALUE,...], e.g. "
+                      "threshold:p:above=2000,hyst=50, rate:itrms:max=5, "
+                      "cusum:p:h=400,k=20, sentinel:icf. Events are "
+                      "written to the log file (or stdout without -L), sent "
+                      "to the event socket and, with --mqtt, published to "
+                      "TOPIC/event/RULE.")
+        group.add_argument("--event", action="append", default=[],
+                           type=EventSink._check_rule, metavar="RULE",
+                           help="Detect events with this rule (repeatable)")
+        group.add_argument("--event-socket", default=None,
+                           type=EventSink._check_socket, metavar="ADDRESS",
+                           help="Send events as JSON datagrams to this Unix "
+                                "socket path or UDP HOST:PORT")
+
+    # The option checks run at argument parsing, before the device is reset,
+    # so that a typo does not interrupt a running analyzer.
+    @staticmethod
+    def _check_rule(spec):
+        import powerlogevents
+        try:
+            powerlogevents.parse_rule(spec, VAL)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e)) from None
+        return spec
+
+    @staticmethod
+    def _check_socket(address):
+        import powerlogevents
+        try:
+            powerlogevents.resolve_address(address)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e)) from None
+        return address
+
+    @staticmethod
+    def enabled(args):
+        return bool(args.event)
+
+    def __init__(self, args, fields, log=None, mqtt_client=None):
+        """Report events to `log` (a RotatingLog) or, without it, stdout.
+
+        With `mqtt_client`, events are also published via MQTT. The log and
+        the client belong to the file and MQTT sinks and are not closed here.
+        """
+        super().__init__(args, fields)
+        import powerlogevents
+
+        rules = [powerlogevents.parse_rule(spec, fields)
+                 for spec in args.event]
+        self._socket = None
+        notifiers = []
+        if args.event_socket:
+            self._socket = powerlogevents.SocketNotifier(args.event_socket)
+            notifiers.append(self._socket)
+        if mqtt_client is not None:
+            notifiers.append(powerlogevents.MQTTNotifier(mqtt_client,
+                                                         args.mqtt_topic))
+        if log is not None:
+            def write_log(line):
+                # As comments, which gnuplot and friends skip.
+                log.write("# " + line)
         else:
-            mqtt_client = mqtt.Client()
-        mqtt_client.on_connect = on_mqtt_connect
-        if args.mqtt_username:
-            mqtt_client.username_pw_set(args.mqtt_username, args.mqtt_password)
-        mqtt_client.connect(args.mqtt_host, args.mqtt_port)
-        mqtt_client.loop_start()
-        publish_mqtt_discovery(mqtt_client, args.mqtt_topic)
+            write_log = self._print
+        self._detector = powerlogevents.EventDetector(rules, notifiers,
+                                                      write_log)
+        print("detecting events:", ", ".join(r.name for r in rules))
+
+    @staticmethod
+    def _print(line: str) -> None:
+        # Start at the beginning of the line to overwrite the live counter.
+        prefix = "\r" if sys.stdout.isatty() else ""
+        sys.stdout.write(prefix + line + "\n")
+        sys.stdout.flush()
+
+    def write(self, rows):
+        for data in rows:
+            self._detector.process(data)
+
+    def close(self):
+        print(self._detector.summary())
+        if self._socket:
+            self._socket.close()
+
+
+# Sinks shipped with powerlog95, in the order they receive each row
+BUILTIN_SINKS = {
+    "events": EventSink,
+    "stdout": StdoutSink,
+    "file": FileSink,
+    "influxdb": InfluxDBSink,
+    "mqtt": MQTTSink,
+}
+
+SINK_GROUP = "lmgtools.sinks"
+
+
+def read_row(lmg: lmg95.lmg95) -> list[float]:
+    """Read the next measurement row, prefixed with the host time."""
+    data = lmg.read_values()
+    data.insert(0, time.time())
+    return data
+
+
+def write_rows(sinks: list, rows: list[list[float]]) -> None:
+    """Pass a batch of measurement rows to each sink in turn."""
+    for sink in sinks:
+        sink.write(rows)
+
+
+def load_sink(name: str) -> type:
+    """Return the sink class registered as `name`.
+
+    Entry points are only consulted for names that are not built in, so the
+    (comparatively slow) package metadata scan is skipped unless a plugin is
+    requested.
+    """
+    if name in BUILTIN_SINKS:
+        return BUILTIN_SINKS[name]
+    from importlib.metadata import entry_points
+    for ep in entry_points(group=SINK_GROUP):
+        if ep.name == name:
+            try:
+                return ep.load()
+            except Exception as e:
+                raise ImportError(f"cannot load {ep.value}: {e}") from e
+    raise LookupError(f"unknown sink: {name}")
+
+
+def open_sinks(args: argparse.Namespace, sink_classes: list[type]) -> list:
+    """Open the given sinks, in the order they receive each row.
+
+    If a sink cannot be opened, the ones opened before are closed again.
+    The event sink is opened last, so that it can share the log file and
+    the MQTT client of the other sinks.
+    """
+    opened = {}
+    try:
+        for sink_cls in sorted(sink_classes, key=lambda c: c is EventSink):
+            if sink_cls is EventSink:
+                file_sink = opened.get(FileSink)
+                mqtt_sink = opened.get(MQTTSink)
+                sink = EventSink(
+                    args, VAL, log=file_sink.log if file_sink else None,
+                    mqtt_client=mqtt_sink.client if mqtt_sink else None)
+            else:
+                sink = sink_cls(args, VAL)
+            opened[sink_cls] = sink
+    except BaseException:
+        for sink in reversed(list(opened.values())):
+            sink.close()
+        raise
+    return [opened[sink_cls] for sink_cls in sink_classes]
+
+
+def main():
+    """Application entry point"""
+    # Plugin sinks may add their own options, so load them before parsing.
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument("--sink", action="append", default=[])
+    plugin_names = pre_parser.parse_known_args()[0].sink
+
+    parser = argparse.ArgumentParser(
+        description="Log measured values from ZES Zimmer LMG95 Power Meter")
+    parser.add_argument("host", help="Hostname of RS232-Ethernet converter")
+    parser.add_argument("-p", "--port", type=int, default=2101,
+                        help="TCP port of RS232-Ethernet converter")
+    parser.add_argument("-l", "--lowpass", action="store_true", default=False,
+                        help="Enable 60 Hz low pass filter")
+    parser.add_argument("-i", "--interval", type=float, default=0.5,
+                        help="Measurement interval in seconds")
+    parser.add_argument("--current-range", type=float, default=None,
+                        help="Fixed current range in A "
+                             "(default: automatic ranging)")
+    parser.add_argument("--voltage-range", type=float, default=None,
+                        help="Fixed voltage range in V "
+                             "(default: automatic ranging)")
+    parser.add_argument("--sink", action="append", default=[], metavar="NAME",
+                        help=f"Enable a sink plugin from the entry point "
+                             f"group {SINK_GROUP} (repeatable)")
+
+    for sink_cls in BUILTIN_SINKS.values():
+        sink_cls.add_arguments(parser)
+    plugins = []
+    for n, name in enumerate(plugin_names):
+        if name in BUILTIN_SINKS:
+            parser.error(f"sink {name} is built in, "
+                         "enable it with its own options")
+        if name in plugin_names[:n]:
+            parser.error(f"sink {name} given more than once")
+        try:
+            sink_cls = load_sink(name)
+        except (LookupError, ImportError) as e:
+            print("error: could not load sink", name + ":", e,
+                  file=sys.stderr)
+            sys.exit(1)
+        sink_cls.add_arguments(parser)
+        plugins.append(sink_cls)
+
+    args = parser.parse_args()
 
     print("connecting to", args.host, "at port", args.port)
     lmg = lmg95.lmg95(args.host, args.port)
@@ -264,9 +590,15 @@ def main():
     lmg.set_ranges(current=args.current_range, voltage=args.voltage_range)
     lmg.select_values(VAL)
 
-    log = None
-    if args.logfile:
-        log = open(args.logfile, "w", encoding="utf-8")
+    # Open the sinks (and truncate the log file) only once the device is set
+    # up, so a failed connection leaves an existing log untouched.
+    sink_classes = [c for c in BUILTIN_SINKS.values() if c.enabled(args)]
+    try:
+        sinks = open_sinks(args, sink_classes + plugins)
+    except (ImportError, ValueError, OSError) as e:
+        print("error:", e, file=sys.stderr)
+        lmg.disconnect()
+        sys.exit(1)
 
     # Treat SIGTERM (e.g. from a container/service manager) like Ctrl-C so the
     # device is released cleanly instead of being left in remote mode.
@@ -279,39 +611,24 @@ def main():
     i = 0
     try:
         lmg.cont_on()
-        if log:
-            log.write("# time " + " ".join(VAL) + "\n")
-            print("writing values to", args.logfile)
         print("logging started; stop the process (Ctrl-C / SIGTERM) to end")
         while True:
-            data = lmg.read_values()
+            data = read_row(lmg)
             i += 1
-            data.insert(0, time.time())
-            if args.verbose:
-                sys.stdout.write(" ".join([str(x) for x in data]) + "\n")
-                sys.stdout.flush()
-            elif show_counter:
+            if show_counter:
                 sys.stdout.write(f"\r{i}")
                 sys.stdout.flush()
-            if log:
-                log.write(" ".join([str(x) for x in data]) + "\n")
-                log.flush()
-            if influx:
-                send_to_influxdb(influx, data)
-            if mqtt_client:
-                publish_mqtt_state(mqtt_client, args.mqtt_topic, data)
+            write_rows(sinks, [data])
     except KeyboardInterrupt:
         print()
 
     print("stopping, releasing device")
-    lmg.cont_off()
-    if log:
-        log.close()
-    if mqtt_client:
-        mqtt_client.loop_stop()
-        mqtt_client.disconnect()
-
-    lmg.disconnect()
+    try:
+        lmg.cont_off()
+        for sink in reversed(sinks):
+            sink.close()
+    finally:
+        lmg.disconnect()
     print("done,", i, "measurements written")
 
 
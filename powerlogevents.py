@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+powerlogevents.py
+
+Streaming event detection on live power measurements.
+
+Rules watch a single measured value and are updated once per measurement
+row, in constant time and memory. A rule is given on the command line as
+
+    KIND:FIELD[:KEY=VALUE,...]
+
+with the following kinds:
+
+    threshold:p:above=2000,hyst=50
+        Value rises above `above` (or falls below `below`). The event is
+        cleared once the value is back by more than `hyst`.
+    rate:itrms:max=5
+        Absolute rate of change exceeds `max` units per second.
+    cusum:p:h=400,k=20
+        Two-sided CUSUM step detection: the cumulative deviation from the
+        mean since the last step, less a slack of `k` per sample, exceeds
+        `h`. Detects level changes such as HPL phase transitions.
+    sentinel:icf
+        The device reports an overrange/invalid sentinel (e.g. 9.91e37).
+
+Every rule also accepts `name=...` (default: KIND_FIELD). Detected events
+are passed to notifiers; the time from detection until all notifiers have
+returned is measured and reported.
+"""
+
+import json
+import socket
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+import lmg95
+
+
+class Rule(ABC):
+    """Base class for detection rules on one measured value."""
+
+    kind = ""
+
+    def __init__(self, field: str, index: int, name: str | None = None):
+        self.field = field
+        self.index = index
+        self.name = name or f"{self.kind}_{field}"
+
+    @abstractmethod
+    def update(self, t: float, value: float) -> dict | None:
+        """Process one sample, return event details or None."""
+
+    def _event(self, state: str, value: float, **details) -> dict:
+        event = {
+            "rule": self.name,
+            "kind": self.kind,
+            "field": self.field,
+            "state": state,
+            "value": value,
+        }
+        event.update(details)
+        return event
+
+
+class ThresholdRule(Rule):
+    """Threshold crossing with hysteresis."""
+
+    kind = "threshold"
+
+    def __init__(self, field, index, name=None, above: float | None = None,
+                 below: float | None = None, hyst: float = 0.0):
+        super().__init__(field, index, name)
+        if above is None and below is None:
+            raise ValueError(f"{self.name}: needs above= and/or below=")
+        self.above = above
+        self.below = below
+        self.hyst = hyst
+        self.state = "normal"
+
+    def update(self, t, value):
+        if lmg95.is_sentinel(value):
+            return None
+        state = self.state
+        if self.above is not None and value > self.above:
+            state = "above"
+        elif self.below is not None and value < self.below:
+            state = "below"
+        elif state == "above" and value < self.above - self.hyst:
+            state = "normal"
+        elif state == "below" and value > self.below + self.hyst:
+            state = "normal"
+        if state == self.state:
+            return None
+        # A "normal" event reports the limit that was cleared.
+        limit = {"above": self.above, "below": self.below}[
+            state if state != "normal" else self.state]
+        self.state = state
+        return self._event(state, value, limit=limit)
+
+
+class RateRule(Rule):
+    """Rate of change limit, in units per second."""
+
+    kind = "rate"
+
+    def __init__(self, field, index, name=None, max: float | None = None):
+        super().__init__(field, index, name)
+        if max is None:
+            raise ValueError(f"{self.name}: needs max=")
+        self.max = max
+        self._last = None
+
+    def update(self, t, value):
+        if lmg95.is_sentinel(value):
+            self._last = None
+            return None
+        last, self._last = self._last, (t, value)
+        if last is None or t <= last[0]:
+            return None
+        rate = (value - last[1]) / (t - last[0])
+        if abs(rate) <= self.max:
+            return None
+        return self._event("rising" if rate > 0 else "falling", value,
+                           rate=rate, previous=last[1])
+
+
+class CusumRule(Rule):
+    """Two-sided CUSUM detection of steps in the mean level."""
+
+    kind = "cusum"
+
+    def __init__(self, field, index, name=None, h: float | None = None,
+                 k: float = 0.0, warmup: int = 3):
+        super().__init__(field, index, name)
+        if h is None:
+            raise ValueError(f"{self.name}: needs h=")
+        self.h = h
+        self.k = k
+        if warmup != int(warmup) or warmup < 0:
+            raise ValueError(f"{self.name}: warmup= must be a whole number "
+                             "of samples")
+        self.warmup = int(warmup)
+        self._reset()
+
+    def _reset(self) -> None:
+        self._n = 0
+        self._mean = 0.0
+        self._pos = 0.0
+        self._neg = 0.0
+
+    def update(self, t, value):
+        if lmg95.is_sentinel(value):
+            return None
+        if self._n >= self.warmup:
+            deviation = value - self._mean
+            self._pos = max(0.0, self._pos + deviation - self.k)
+            self._neg = max(0.0, self._neg - deviation - self.k)
+            if self._pos > self.h or self._neg > self.h:
+                state = "step_up" if self._pos > self.h else "step_down"
+                level = self._mean
+                self._reset()
+                self._n = 1
+                self._mean = value
+                return self._event(state, value, level=level)
+        # Running mean of the current level
+        self._n += 1
+        self._mean += (value - self._mean) / self._n
+        return None
+
+
+class SentinelRule(Rule):
+    """Device reports an invalid or overrange value."""
+
+    kind = "sentinel"
+
+    def __init__(self, field, index, name=None):
+        super().__init__(field, index, name)
+        self.state = "normal"
+
+    def update(self, t, value):
+        state = "overrange" if lmg95.is_sentinel(value) else "normal"
+        if state == self.state:
+            return None
+        self.state = state
+        return self._event(state, value)
+
+
+RULES = {cls.kind: cls for cls in (ThresholdRule, RateRule, CusumRule,
+                                   SentinelRule)}
+
+
+def parse_rule(spec: str, fields: list[str]) -> Rule:
+    """Create a rule from a KIND:FIELD[:KEY=VALUE,...] specification.
+
+    `fields` names the values of a measurement row after the timestamp.
+    """
+    parts = spec.split(":", 2)
+    if len(parts) < 2:
+        raise ValueError(f"invalid event rule {spec!r}, expected KIND:FIELD")
+    kind, field = parts[0], parts[1]
+    if kind not in RULES:
+        raise ValueError(f"unknown event rule kind {kind!r} "
+                         f"(available: {', '.join(RULES)})")
+    if field not in fields:
+        raise ValueError(f"unknown field {field!r} in event rule {spec!r}")
+    options = {}
+    if len(parts) == 3 and parts[2]:
+        for item in parts[2].split(","):
+            key, sep, value = item.partition("=")
+            if not sep:
+                raise ValueError(f"invalid option {item!r} in {spec!r}")
+            if key == "name":
+                options[key] = value
+                continue
+            try:
+                options[key] = float(value)
+            except ValueError:
+                raise ValueError(f"invalid value {value!r} for {key} in "
+                                 f"{spec!r}") from None
+    try:
+        return RULES[kind](field, fields.index(field) + 1, **options)
+    except TypeError:
+        raise ValueError(f"invalid options for {kind} rule in {spec!r}") \
+            from None
+
+
+def resolve_address(address: str) -> tuple[int, int, int, str | tuple]:
+    """Resolve a Unix socket path or UDP HOST:PORT for sending datagrams.
+
+    Returns family, type, protocol and the address to send to.
+    """
+    if ":" not in address or address.startswith(("/", ".")):
+        return socket.AF_UNIX, socket.SOCK_DGRAM, 0, address
+    host, port = address.rsplit(":", 1)
+    if host.startswith("[") and host.endswith("]"):
+        host = host[1:-1]
+    try:
+        family, type_, proto, _, addr = socket.getaddrinfo(
+            host, int(port), type=socket.SOCK_DGRAM)[0]
+    except (ValueError, OSError) as e:
+        raise ValueError(f"invalid socket address {address!r}: {e}") \
+            from None
+    return family, type_, proto, addr
+
+
+class SocketNotifier:
+    """Send events as JSON datagrams to a local socket.
+
+    `address` is a Unix socket path or HOST:PORT for UDP. Sending never
+    blocks; events are dropped while nobody is listening.
+    """
+
+    def __init__(self, address: str):
+        # Resolve once here, not on every event
+        family, type_, proto, self._addr = resolve_address(address)
+        self._s = socket.socket(family, type_, proto)
+        self._s.setblocking(False)
+
+    def __call__(self, event: dict) -> None:
+        try:
+            self._s.sendto(json.dumps(event).encode("utf-8"), self._addr)
+        except OSError:
+            pass
+
+    def close(self) -> None:
+        self._s.close()
+
+
+class MQTTNotifier:
+    """Publish events to `{topic}/event/{rule}` on an MQTT client."""
+
+    def __init__(self, client, topic: str):
+        self._client = client
+        self._topic = topic
+
+    def __call__(self, event: dict) -> None:
+        self._client.publish(f"{self._topic}/event/{event['rule']}",
+                             json.dumps(event))
+
+
+class EventDetector:
+    """Run rules on each measurement row and dispatch detected events.
+
+    After the notifiers, each event is passed as a line of text to `log`,
+    including the measured notification latency. Rows too short for the
+    rules (no values read before a timeout) are skipped.
+    """
+
+    def __init__(self, rules: list[Rule], notifiers: list,
+                 log: Callable[[str], None] = print):
+        self.rules = rules
+        self.notifiers = notifiers
+        self.log = log
+        self._width = max((rule.index for rule in rules), default=0) + 1
+        self.count = 0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+    def process(self, row: list[float]) -> None:
+        """Update all rules with a row (timestamp first)."""
+        if len(row) < self._width:
+            return
+        t = row[0]
+        for rule in self.rules:
+            event = rule.update(t, row[rule.index])
+            if event is not None:
+                self._dispatch(t, event)
+
+    def _dispatch(self, t: float, event: dict) -> None:
+        start = time.perf_counter()
+        event["time"] = t
+        event["detected"] = time.time()
+        for notify in self.notifiers:
+            notify(event)
+        latency = time.perf_counter() - start
+        self.count += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.log(f"event: {t} {event['rule']} {event['state']} "
+                 f"{event['field']}={event['value']:g} "
+                 f"(detected {(event['detected'] - t) * 1e3:.1f} ms after "
+                 f"sample, notified in {latency * 1e6:.0f} µs)")
+
+    def summary(self) -> str:
+        """Return a one-line summary of the notification latency."""
+        if not self.count:
+            return "no events detected"
+        mean = self.total_latency / self.count
+        return (f"{self.count} events, notification latency "
+                f"mean {mean * 1e6:.0f} µs, max {self.max_latency * 1e6:.0f} µs")
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+powerlogfile.py
+
+Rotating, compressed log files for the powerlog scripts.
+
+The active segment is always written to the configured log file name. When it
+exceeds a size or age limit, it is fsync'd, renamed to a numbered segment
+(e.g. ``powerlog.0001``) and handed to a background process that compresses
+it to ``powerlog.0001.gz`` (or ``.xz``/``.zst``). The logging loop only pays
+for the fsync and rename; compression runs at the lowest CPU priority and
+never blocks it.
+
+Every segment starts with the same header line, so each compressed file is
+self-describing. ``iter_lines()`` reads all segments of a log in order, plus
+the active file, and yields the header only once.
+
+Run as a script to print a (possibly rotated) log to stdout:
+
+    python3 powerlogfile.py powerlog.log | gnuplot ...
+"""
+
+# The compression modules and the worker pool are imported where they are
+# used, so that importing this module does not slow down powerlog startup.
+import argparse
+import os
+import re
+import sys
+import time
+from collections.abc import Iterator
+
+# Suffix appended to a rotated segment for each compression method
+SUFFIX = {
+    "none": "",
+    "gzip": ".gz",
+    "bz2": ".bz2",
+    "xz": ".xz",
+    "zstd": ".zst",
+}
+
+COPY_CHUNK = 1 << 20
+
+
+def _zstd():
+    """Return the zstd module, or None if zstd support is not installed.
+
+    zstd is in the standard library from Python 3.14 on; fall back to the
+    zstandard package on older versions.
+    """
+    try:
+        from compression import zstd
+    except ImportError:
+        try:
+            import zstandard as zstd
+        except ImportError:
+            return None
+    return zstd
+
+
+def parse_size(text: str) -> int:
+    """Parse a byte count with an optional K/M/G suffix (powers of 1024)."""
+    units = {"": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30}
+    m = re.fullmatch(r"\s*(\d+(?:\.\d*)?)\s*([kmg]?)i?b?\s*", text.lower())
+    if not m:
+        raise argparse.ArgumentTypeError(f"invalid size: {text!r}")
+    return int(float(m.group(1)) * units[m.group(2)])
+
+
+def _open_compressed_write(path: str, method: str):
+    if method == "gzip":
+        import gzip
+        # Fixed mtime keeps identical input from producing different output.
+        return gzip.GzipFile(path, "wb", compresslevel=6, mtime=0)
+    if method == "bz2":
+        import bz2
+        return bz2.BZ2File(path, "wb")
+    if method == "xz":
+        import lzma
+        return lzma.LZMAFile(path, "wb", preset=6)
+    if method == "zstd":
+        return _zstd().open(path, "wb")
+    raise ValueError(f"unknown compression method: {method}")
+
+
+def _open_text_read(path: str):
+    """Open a plain or compressed segment for reading as text."""
+    if path.endswith(".gz"):
+        import gzip
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".bz2"):
+        import bz2
+        return bz2.open(path, "rt", encoding="utf-8")
+    if path.endswith(".xz"):
+        import lzma
+        return lzma.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        zstd = _zstd()
+        if zstd is None:
+            raise RuntimeError(f"zstd support not installed, cannot read {path}")
+        return zstd.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def _fsync_dir(path: str) -> None:
+    """Persist a rename by syncing the containing directory (POSIX only)."""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def compress_file(src: str, method: str) -> str:
+    """Compress `src` next to itself, remove it and return the new name.
+
+    The output is written to a temporary name first and renamed only once it
+    is complete, so a reader never sees a truncated compressed segment.
+    """
+    import shutil
+    dst = src + SUFFIX[method]
+    if dst == src:
+        return src
+    tmp = dst + ".tmp"
+    with open(src, "rb") as fin, _open_compressed_write(tmp, method) as fout:
+        shutil.copyfileobj(fin, fout, COPY_CHUNK)
+    with open(tmp, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, dst)
+    _fsync_dir(dst)
+    os.remove(src)
+    return dst
+
+
+def _init_worker() -> None:
+    """Set up the compression worker process."""
+    import signal
+    # Ctrl-C is meant for the logging process, which stops the worker
+    # through finish(); the worker must not die halfway through a segment.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(os, "nice"):
+        os.nice(19)
+
+
+class _Compressor:
+    """Background worker process that compresses rotated segments in order.
+
+    A separate process at the lowest CPU priority keeps compression from
+    competing with the logging loop, also on a busy or single-core host.
+    If the worker dies, segments stay uncompressed on disk and are compressed
+    by the next run on the same file (see RotatingLog._recover()).
+    """
+
+    def __init__(self, method: str):
+        from concurrent.futures import ProcessPoolExecutor
+        self._method = method
+        self._executor = ProcessPoolExecutor(max_workers=1,
+                                             initializer=_init_worker)
+        # Start the worker now rather than at the first rotation, so process
+        # startup is not paid inside the logging loop.
+        self._executor.submit(os.getpid)
+
+    def submit(self, path: str) -> None:
+        from concurrent.futures import BrokenExecutor
+        try:
+            future = self._executor.submit(compress_file, path, self._method)
+        except BrokenExecutor as e:
+            self._report(path, e)
+            return
+        future.add_done_callback(lambda f: self._report(path, f.exception()))
+
+    @staticmethod
+    def _report(path: str, e: BaseException | None) -> None:
+        if e is not None:
+            print(f"error: could not compress {path}, left for the next run:",
+                  e, file=sys.stderr)
+
+    def finish(self) -> None:
+        """Compress all pending segments, then stop the worker."""
+        from concurrent.futures import BrokenExecutor
+        try:
+            self._executor.shutdown(wait=True)
+        except BrokenExecutor as e:
+            print("error: compression worker failed:", e, file=sys.stderr)
+
+
+def _scan(path: str) -> tuple[dict[int, dict[str, str]], list[str]]:
+    """Find the files belonging to rotated segments of log file `path`.
+
+    Returns the files of each segment by index and suffix ("" for an
+    uncompressed segment), and the temporary files of interrupted
+    compressions.
+    """
+    directory = os.path.dirname(path) or "."
+    base = os.path.basename(path)
+    pattern = re.compile(re.escape(base)
+                         + r"\.(\d+)(\.gz|\.bz2|\.xz|\.zst)?(\.tmp)?")
+    found: dict[int, dict[str, str]] = {}
+    stale = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return found, stale
+    for name in names:
+        m = pattern.fullmatch(name)
+        if not m:
+            continue
+        full = os.path.join(directory, name)
+        if m.group(3):
+            stale.append(full)
+        else:
+            found.setdefault(int(m.group(1)), {})[m.group(2) or ""] = full
+    return found, stale
+
+
+def segments(path: str) -> list[str]:
+    """Return the rotated segments of log file `path` in write order.
+
+    If a segment exists both uncompressed and compressed (compression just
+    finished), the compressed file is returned; it only appears under its
+    final name once complete.
+    """
+    found, _ = _scan(path)
+    result = []
+    for index in sorted(found):
+        files = found[index]
+        compressed = [files[s] for s in files if s]
+        result.append(compressed[0] if compressed else files[""])
+    return result
+
+
+def iter_lines(path: str) -> Iterator[str]:
+    """Yield all lines of a rotated log, oldest first, without newlines.
+
+    Reads the compressed and uncompressed segments and finally the active
+    file `path`. The header line repeated at the start of each segment is
+    only yielded once.
+    """
+    files = segments(path)
+    if os.path.exists(path):
+        files.append(path)
+    header = None
+    for name in files:
+        try:
+            f = _open_text_read(name)
+        except FileNotFoundError:
+            # Compressed and removed by the writer after we listed it
+            compressed = [name + s for s in SUFFIX.values()
+                          if s and os.path.exists(name + s)]
+            if not compressed:
+                raise
+            f = _open_text_read(compressed[0])
+        with f:
+            for n, line in enumerate(f):
+                line = line.rstrip("\n")
+                if n == 0 and line.startswith("#"):
+                    if line == header:
+                        continue
+                    header = line
+                yield line
+
+
+class RotatingLog:
+    """Line-oriented log file with size/time rotation and compression.
+
+    Without `max_bytes` and `max_age` this behaves like a plain text file
+    that is flushed after each line. Otherwise the active segment is rotated
+    when either limit is reached, and on close().
+    """
+
+    def __init__(self, path: str, header: str | None = None,
+                 max_bytes: int | None = None, max_age: float | None = None,
+                 compress: str = "gzip"):
+        if compress not in SUFFIX:
+            raise ValueError(f"unknown compression method: {compress}")
+        if compress == "zstd" and _zstd() is None:
+            raise ImportError("zstd support not installed (needs Python 3.14 "
+                              "or the zstandard package)")
+        self.path = path
+        self._header = header
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._rotating = bool(max_bytes or max_age)
+        self._compressor = None
+        if self._rotating and compress != "none":
+            self._compressor = _Compressor(compress)
+        self._index = 0
+        if self._rotating:
+            self._recover()
+        self._file = None
+        self._open_segment()
+
+    def _recover(self) -> None:
+        """Pick up the segments left behind by an earlier, interrupted run.
+
+        Numbering continues after the existing segments, and a leftover
+        active file is rotated out first, so a new run never overwrites data
+        from a previous one. Segments whose compression never ran or was
+        interrupted are queued again.
+        """
+        found, stale = _scan(self.path)
+        for tmp in stale:
+            os.remove(tmp)
+        for index in sorted(found):
+            files = found[index]
+            plain = files.get("")
+            if plain is None:
+                continue
+            if len(files) > 1:
+                # Compressed copy is complete; only the removal was missed.
+                os.remove(plain)
+            elif self._compressor:
+                self._compressor.submit(plain)
+        if found:
+            self._index = max(found)
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            self._rotate_file()
+
+    def _open_segment(self) -> None:
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._size = 0
+        self._opened = time.monotonic()
+        if self._header is not None:
+            self.write(self._header)
+
+    def _close_segment(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def write(self, line: str) -> None:
+        """Write one line (without trailing newline) and flush it."""
+        if self._rotating and self._size > 0 and self._due():
+            self.rotate()
+        data = line + "\n"
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+
+    def _due(self) -> bool:
+        if self._max_bytes and self._size >= self._max_bytes:
+            return True
+        if self._max_age and time.monotonic() - self._opened >= self._max_age:
+            return True
+        return False
+
+    def rotate(self) -> None:
+        """Close the active segment, queue it for compression, start a new one."""
+        self._rotate_out()
+        self._open_segment()
+
+    def _rotate_out(self) -> None:
+        self._close_segment()
+        self._rotate_file()
+
+    def _rotate_file(self) -> None:
+        self._index += 1
+        rotated = f"{self.path}.{self._index:04d}"
+        os.replace(self.path, rotated)
+        _fsync_dir(rotated)
+        if self._compressor:
+            self._compressor.submit(rotated)
+
+    def close(self) -> None:
+        """Close the log and wait until all segments are compressed.
+
+        With rotation enabled, the final segment is rotated out as well, so
+        that nothing is left uncompressed. Segments a killed process could
+        not compress are compressed by the next run on the same file.
+        """
+        if self._file is None:
+            return
+        if self._rotating:
+            self._rotate_out()
+        else:
+            self._close_segment()
+        self._file = None
+        if self._compressor:
+            self._compressor.finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    """Print a rotated, possibly compressed log file to stdout"""
+    parser = argparse.ArgumentParser(
+        description="Print all segments of a rotated powerlog file in order")
+    parser.add_argument("logfile", help="Log file name as given to -L")
+    args = parser.parse_args()
+
+    try:
+        for line in iter_lines(args.logfile):
+            sys.stdout.write(line + "\n")
+    except BrokenPipeError:
+        # Output piped into e.g. head; exit quietly.
+        sys.stderr.close()
+
+
+if __name__ == "__main__":
+    main()